@@ -0,0 +1,148 @@
+#
+# Anserini: A Lucene toolkit for reproducible information retrieval research
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Fusion of TREC runs with NumPy and pandas, mirroring io.anserini.fusion.FuseRuns.
+
+Each run is parsed once into a DataFrame of (qid, docid, rank, score) and shared by every fusion
+method that uses it. Scores follow the float arithmetic of ScoredDocsFuser, so output files match
+the ones FuseRuns writes.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+TREC_RUN_COLUMNS = ['qid', 'q0', 'docid', 'rank', 'score', 'tag']
+RUNTAG = 'anserini.fusion'
+
+
+@lru_cache(maxsize=None)
+def read_run(run_file):
+    """Read a whole TREC run in file order; like FuseRuns, input runs are never cut by rank.
+
+    Parsed runs are cached and shared between callers, so they must not be modified. Call
+    read_run.cache_clear() once the runs are no longer needed.
+    """
+    dtype = {'qid': str, 'docid': str, 'rank': np.int64, 'score': np.float32}
+    try:
+        return pd.read_csv(run_file, sep=r'\s+', header=None, names=TREC_RUN_COLUMNS,
+                           usecols=list(dtype), dtype=dtype, engine='c')
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame({column: pd.Series(dtype=t) for column, t in dtype.items()})
+
+
+def normalize(run):
+    """Min-max normalize scores per topic to [0, 1]; a topic whose scores are all equal gets 1.0."""
+    scores = run.groupby('qid', sort=False)['score']
+    lo = scores.transform('min').to_numpy(dtype=np.float32)
+    hi = scores.transform('max').to_numpy(dtype=np.float32)
+    span = hi - lo
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normalized = np.where(span == 0, np.float32(1.0), (run['score'].to_numpy(dtype=np.float32) - lo) / span)
+    return run.assign(score=normalized.astype(np.float32))
+
+
+def _merge(runs, scores, depth=None):
+    """Sum the per-run scores of each (qid, docid), like ScoredDocsFuser.merge.
+
+    qids and docids are factorized to integer codes, each (qid, docid) pair gets one int64 code, and
+    scores are summed over those codes with np.bincount. With depth, only the first depth scores of
+    a (qid, docid), in run order, are summed (None for no limit).
+    """
+    qid_codes, qids = pd.factorize(np.concatenate([run['qid'].to_numpy() for run in runs]))
+    docid_codes, docids = pd.factorize(np.concatenate([run['docid'].to_numpy() for run in runs]))
+    codes, pairs = pd.factorize(qid_codes.astype(np.int64) * len(docids) + docid_codes)
+    weights = np.concatenate(scores)
+    if depth is not None and len(codes) and np.bincount(codes).max() > depth:
+        seen = pd.Series(codes).groupby(codes, sort=False).cumcount().to_numpy()
+        weights = np.where(seen < depth, weights, np.float32(0))
+    return pd.DataFrame({
+        'qid': qids[pairs // len(docids)],
+        'docid': docids[pairs % len(docids)],
+        'score': np.bincount(codes, weights=weights, minlength=len(pairs)).astype(np.float32),
+    })
+
+
+def rrf(runs, rrf_k=60, depth=None):
+    """Reciprocal rank fusion: each run contributes 1 / (rrf_k + rank)."""
+    return _merge(runs, [(1.0 / (rrf_k + run['rank'].to_numpy(dtype=np.float64))).astype(np.float32)
+                         for run in runs], depth)
+
+
+def wsum(runs, weights, depth=None):
+    """Weighted sum of scores, one weight per run."""
+    if len(runs) != len(weights):
+        raise ValueError('Number of runs must match number of weights')
+    return _merge(runs, [(run['score'].to_numpy(dtype=np.float64) * weight).astype(np.float32)
+                         for run, weight in zip(runs, weights)], depth)
+
+
+def average(runs, depth=None):
+    """Average of scores; a document missing from a run contributes 0 for it."""
+    return wsum(runs, [1 / len(runs)] * len(runs), depth)
+
+
+def interpolation(runs, alpha=0.5, depth=None):
+    """alpha * first run score + (1 - alpha) * second run score."""
+    if len(runs) != 2:
+        raise ValueError('Interpolation requires exactly 2 runs')
+    return wsum(runs, [alpha, 1 - alpha], depth)
+
+
+def write_run(fused, output, k=1000, runtag=RUNTAG):
+    """Write the top k documents per topic in TREC format, sorted by topic and then score like FuseRuns.
+
+    Raises ValueError for an empty run, where FuseRuns fails with "Nothing to save".
+    """
+    if fused.empty:
+        raise ValueError('Nothing to save. Fused run is empty')
+    fused = fused.sort_values(['qid', 'score', 'docid'], ascending=[True, False, False], kind='stable')
+    fused = fused.assign(rank=fused.groupby('qid', sort=False).cumcount() + 1)
+    fused = fused[fused['rank'] <= k]
+    fused.assign(q0='Q0', tag=runtag)[['qid', 'q0', 'docid', 'rank', 'score', 'tag']].to_csv(
+        output, sep=' ', header=False, index=False, float_format='%.6f')
+
+
+METHODS = ('rrf', 'average', 'interpolation')
+
+
+def fuse(run_files, output, method='rrf', rrf_k=60, alpha=0.5, k=1000, depth=1000,
+         min_max_normalization=False, runtag=RUNTAG):
+    """Fuse run files into output; arguments have the same meaning as the FuseRuns options.
+
+    As in FuseRuns, input runs are read whole (and min-max normalized over the whole file); depth caps
+    how many runs are summed for each (qid, docid), and k caps the number of documents written per topic.
+    """
+    if depth <= 0:
+        raise ValueError('Option depth must be greater than 0')
+    if k <= 0:
+        raise ValueError('Option k must be greater than 0')
+
+    runs = [read_run(run_file) for run_file in run_files]
+    if min_max_normalization:
+        runs = [normalize(run) for run in runs]
+
+    if method == 'rrf':
+        fused = rrf(runs, rrf_k, depth)
+    elif method == 'average':
+        fused = average(runs, depth)
+    elif method == 'interpolation':
+        fused = interpolation(runs, alpha, depth)
+    else:
+        raise ValueError(f'Unknown fusion method: {method}. Supported methods are: {", ".join(METHODS)}.')
+
+    write_run(fused, output, k, runtag)
@@ -18,18 +18,37 @@ import os
 import sys
 import argparse
 import logging
+import pickle
 import time
 import yaml
 import re
 import glob
+import hashlib
 from collections import namedtuple
-from subprocess import call, Popen, PIPE, STDOUT
-from ranx import Run, fuse, evaluate, Qrels
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from multiprocessing import Pool
+from subprocess import call, run, Popen, PIPE, STDOUT
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 
 # Constants
-FUSE_CMD = 'bin/run.sh io.anserini.fusion.FuseRuns'
-RANX_METHODS = {"rrf": "rrf", "average": "sum", "normalize": "sum"}
+BEIR_YAML = 'src/main/resources/reproduce/beir.yaml'
+YAML_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'anserini')
+FUSE_CMD = ['bin/run.sh', 'io.anserini.fusion.FuseRuns']
+# Fusion conditions in beir.yaml: name -> (FuseRuns method, min-max normalization)
+FUSION_CONDITIONS = {
+    'fusion-rrf': ('rrf', False),
+    'fusion-avg': ('average', True),
+}
+# FuseRuns method -> ranx method; normalization is passed to ranx separately
+RANX_METHODS = {"rrf": "rrf", "average": "sum"}
 SCORE_TOLERANCE = 1e-3
+TREC_EVAL_CMD = ['bin/trec_eval', '-c', '-m', 'ndcg_cut.10']
+QREL_TMPL = 'tools/topics-and-qrels/qrels.$eval_key.txt'
 
 # Hardcoded patterns matching beir.yaml and RunBeir
 BM25_RUN_TMPL = 'runs/run.beir.flat.$topics.txt'
@@ -37,6 +56,10 @@ BGE_RUN_TMPL = 'runs/run.beir.bge-base-en-v1.5.flat.onnx.$topics.txt'
 K = 1000
 DEPTH = 1000
 RRF_K = 60
+# Methods fusion_numpy implements; kept here so --dry-run doesn't need numpy and pandas
+NATIVE_METHODS = frozenset({'rrf', 'average', 'interpolation'})
+# Below this many run files in one directory, stat'ing each is cheaper than listing the directory
+SCANDIR_MIN_PATHS = 16
 
 # Configure logging to match run_regression.py style
 logger = logging.getLogger('fusion_regression')
@@ -54,13 +77,47 @@ FusionCommand = namedtuple('FusionCommand', [
 ])
 
 def check_output(cmd):
-    """Execute command and return output. Raises RuntimeError on failure."""
-    p = Popen(cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-    out, _ = p.communicate()
-    if p.returncode != 0:
-        error_msg = out.decode('utf-8', errors='replace') if out else "Unknown error"
-        raise RuntimeError(f"Command failed (exit {p.returncode}): {cmd}\n{error_msg}")
-    return out
+    """Execute command (an argv list) and return the last non-blank line of its output.
+
+    Raises RuntimeError on failure.
+    """
+    result = run(cmd, capture_output=True, text=True, encoding='utf-8', errors='replace')
+    if result.returncode != 0:
+        error_msg = (result.stderr or result.stdout).strip() or "Unknown error"
+        raise RuntimeError(f"Command failed (exit {result.returncode}): {' '.join(cmd)}\n{error_msg}")
+    return result.stdout.rstrip().rsplit('\n', 1)[-1].strip()
+
+def load_yaml(yaml_file):
+    """Load a YAML file, using a pickled copy in YAML_CACHE_DIR when it is up to date.
+
+    The pickle is keyed on the YAML file's path, mtime, and size, and rewritten whenever the YAML
+    changes. It lives outside src/main/resources so it never ends up in the fatjar. Parsing uses
+    libyaml's CSafeLoader when available.
+    """
+    path = os.path.abspath(yaml_file)
+    stat = os.stat(path)
+    key = (path, stat.st_mtime, stat.st_size)
+    cache_file = os.path.join(YAML_CACHE_DIR, os.path.basename(path) + '.' +
+                              hashlib.md5(path.encode('utf-8')).hexdigest() + '.pkl')
+    try:
+        with open(cache_file, 'rb') as f:
+            cached_key, data = pickle.load(f)
+        if cached_key == key:
+            return data
+    except Exception:
+        # Missing, unreadable, or malformed cache: fall through and re-parse
+        pass
+
+    with open(yaml_file) as f:
+        data = yaml.load(f, Loader=SafeLoader)
+
+    try:
+        os.makedirs(YAML_CACHE_DIR, exist_ok=True)
+        with open(cache_file, 'wb') as f:
+            pickle.dump((key, data), f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        logger.debug(f"Could not write YAML cache {cache_file}: {e}")
+    return data
 
 def get_fusion_commands(beir_data, corpus=None):
     """Extract fusion commands from beir.yaml.
@@ -69,22 +126,16 @@ def get_fusion_commands(beir_data, corpus=None):
     - Input run files: runs/run.beir.flat.$topics.txt and runs/run.beir.bge-base-en-v1.5.flat.onnx.$topics.txt
     - Output format: runs/run.beir.{condition_name}.{topic_key}.txt (from RunRepro.java line 195)
     - Parameters: k=1000, depth=1000, rrf_k=60
+
+    Commands are grouped by corpus, keeping the beir.yaml condition order within each corpus, so
+    that input runs parsed for one corpus can be released before moving on to the next.
     """
     commands = []
     for cond in beir_data.get('conditions', []):
         cond_name = cond.get('name', '')
-        if not cond_name.startswith('fusion-'):
-            continue
-        
-        # Determine fusion method and parameters from condition
-        if cond_name == 'fusion-rrf':
-            method = 'rrf'
-            has_minmax = False
-        elif cond_name == 'fusion-avg':
-            method = 'average'
-            has_minmax = True  # fusion-avg uses min_max_normalization
-        else:
-            continue  # Skip unknown fusion methods
+        if cond_name not in FUSION_CONDITIONS:
+            continue  # Skip non-fusion conditions and unknown fusion methods
+        method, has_minmax = FUSION_CONDITIONS[cond_name]
         
         # Process each topic
         for topic in cond.get('topics', []):
@@ -110,7 +161,7 @@ def get_fusion_commands(beir_data, corpus=None):
             output = f'runs/run.beir.{cond_name}.{topic_key}.txt'
             
             # Build fusion command
-            cmd = [FUSE_CMD, '-runs'] + run_files + [
+            cmd = FUSE_CMD + ['-runs'] + run_files + [
                 '-output', output,
                 '-method', method,
                 '-k', str(K),
@@ -128,13 +179,16 @@ def get_fusion_commands(beir_data, corpus=None):
                 rrf_k=RRF_K, expected=expected, run_files_tmpl=[BM25_RUN_TMPL, BGE_RUN_TMPL]
             ))
     
-    return commands
+    corpus_order = {}
+    for cmd_data in commands:
+        corpus_order.setdefault(cmd_data.topic_key, len(corpus_order))
+    return sorted(commands, key=lambda cmd_data: corpus_order[cmd_data.topic_key])
 
 def get_condition(beir_data, name):
     return next((c for c in beir_data.get('conditions', []) if c.get('name') == name), None)
 
 def build_search_cmd(cond, topic_key):
-    """Build search command from condition."""
+    """Build search command (an argv list) from condition."""
     name = cond.get('name', '')
     output = f'runs/run.beir.{name}.{topic_key}.txt'
     
@@ -148,7 +202,7 @@ def build_search_cmd(cond, topic_key):
         if class_idx:
             parts = ['bin/run.sh'] + parts[class_idx:]
     
-    return ' '.join(parts), output
+    return parts, output
 
 def ensure_runs(beir_data, corpus):
     """Generate missing run files for BM25 and BGE if needed."""
@@ -178,16 +232,41 @@ def ensure_runs(beir_data, corpus):
         for cond_name, cond, topic in to_gen:
             cmd, output = build_search_cmd(cond, topic['topic_key'])
             logger.info(f"  {cond_name} -> {output}")
-            if call(cmd, shell=True) != 0:
-                raise RuntimeError(f"Failed: {cmd}")
+            if call(cmd) != 0:
+                raise RuntimeError(f"Failed: {' '.join(cmd)}")
+
+@lru_cache(maxsize=None)
+def load_qrels(qrel_file):
+    """Load qrels once per file; shared by every fusion method evaluated against them."""
+    from ranx import Qrels
+    return Qrels.from_file(qrel_file)
+
+@lru_cache(maxsize=None)
+def _load_run(path, mtime, qrel_file):
+    from ranx import Run
+    return Run.from_file(path, kind="trec").make_comparable(load_qrels(qrel_file))
+
+def load_run(run_file, qrel_file):
+    """Load a TREC run made comparable to the given qrels.
+
+    Input runs are shared between fusion conditions, so parsed runs are cached; the file's
+    mtime is part of the key so a regenerated run is picked up. Callers clear the cache once
+    they are done with a corpus.
+    """
+    path = os.path.abspath(run_file)
+    return _load_run(path, os.path.getmtime(path), qrel_file)
+
+def ranx_ndcg(qrel_file, run_files, method, has_minmax, rrf_k):
+    """Get nDCG@10 from ranx for sanity check.
 
-def ranx_ndcg(qrel_file, runs, method, has_minmax, rrf_k):
-    """Get nDCG@10 from ranx for sanity check."""
+    run_files is left untouched; the parsed runs come from load_run() and are shared with other calls.
+    """
     try:
-        qrels = Qrels.from_file(qrel_file)
-        ranx_runs = [Run.from_file(r, kind="trec").make_comparable(qrels) for r in runs]
+        from ranx import fuse, evaluate
+        qrels = load_qrels(qrel_file)
+        ranx_runs = [load_run(run_file, qrel_file) for run_file in run_files]
         
-        ranx_method = RANX_METHODS.get("normalize" if (method == "average" and has_minmax) else method, "sum")
+        ranx_method = RANX_METHODS.get(method, "sum")
         params = {'k': rrf_k} if ranx_method == "rrf" else {}
         norm = "min-max" if has_minmax else None
         
@@ -197,18 +276,15 @@ def ranx_ndcg(qrel_file, runs, method, has_minmax, rrf_k):
         logger.debug(f"Ranx check failed: {e}")
         raise
 
-def parse_trec_eval_output(output_str):
-    """Parse nDCG@10 from trec_eval output.
+def parse_trec_eval_output(last_line):
+    """Parse nDCG@10 from the last line of trec_eval output.
     
     trec_eval output format: 'ndcg_cut_10  all  0.3725'
     Returns the float value or raises ValueError if not found.
     """
-    lines = [l.strip() for l in output_str.split('\n') if l.strip()]
-    if not lines:
+    if not last_line:
         raise ValueError("Empty trec_eval output")
     
-    # Last line should contain the metric value
-    last_line = lines[-1]
     parts = last_line.split('\t')
     if len(parts) < 3:
         parts = last_line.split()
@@ -218,14 +294,51 @@ def parse_trec_eval_output(output_str):
     
     return float(parts[2])
 
-def evaluate_results(commands, dry_run):
-    """Evaluate fusion results."""
+def trec_eval_ndcg(qrel, run_file):
+    """Get nDCG@10 from bin/trec_eval; returns (score, elapsed seconds)."""
+    eval_start = time.time()
+    ndcg = parse_trec_eval_output(check_output(TREC_EVAL_CMD + [qrel, run_file]))
+    return ndcg, time.time() - eval_start
+
+def evaluate_results(commands, dry_run, use_ranx=False, jobs=1, ranx_check=False):
+    """Evaluate fusion results.
+
+    Scores come from bin/trec_eval by default, with up to jobs evaluations running concurrently.
+    With use_ranx, scores are computed in-process with ranx instead; each qrels file is parsed once
+    and shared across fusion methods. With ranx_check, each score is also compared against ranx
+    fusing the input runs itself. Results are logged in command order.
+    """
     failures = 0
     total = len(commands)
+    if use_ranx and not dry_run:
+        # ranx pulls in numba and friends, so it is only imported when scoring with it
+        from ranx import Run, evaluate
+
+    # Fusion conditions share qrels, so resolve and stat each qrel file once
+    qrel_files = {eval_key: QREL_TMPL.replace('$eval_key', eval_key)
+                  for eval_key in set(cmd_data.eval_key for cmd_data in commands)}
+    present = set(eval_key for eval_key, qrel in qrel_files.items() if os.path.exists(qrel))
+
+    # trec_eval calls are subprocess waits, so threads overlap them well. ranx stays on this
+    # thread: numba's default threading layer does not support concurrent callers.
+    trec_eval_futures = {}
+    if not use_ranx and not dry_run:
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            for idx, cmd_data in enumerate(commands, 1):
+                if cmd_data.eval_key in present:
+                    trec_eval_futures[idx] = executor.submit(
+                        trec_eval_ndcg, qrel_files[cmd_data.eval_key], cmd_data.output)
     
+    topic_key = None
     for idx, cmd_data in enumerate(commands, 1):
-        qrel = f'tools/topics-and-qrels/qrels.{cmd_data.eval_key}.txt'
-        if not os.path.exists(qrel):
+        if cmd_data.topic_key != topic_key:
+            # Commands are grouped by corpus, so the previous corpus' qrels and runs are no longer needed
+            load_qrels.cache_clear()
+            _load_run.cache_clear()
+            topic_key = cmd_data.topic_key
+
+        qrel = qrel_files[cmd_data.eval_key]
+        if cmd_data.eval_key not in present:
             logger.warning(f"Skipping {cmd_data.cond_name} {cmd_data.topic_key}: qrel file not found: {qrel}")
             continue
         
@@ -234,12 +347,17 @@ def evaluate_results(commands, dry_run):
             continue
         
         try:
-            # Run trec_eval and parse output
-            eval_start = time.time()
-            trec_cmd = f'bin/trec_eval -c -m ndcg_cut.10 {qrel} {cmd_data.output}'
-            out = check_output(trec_cmd).decode('utf-8')
-            eval_time = time.time() - eval_start
-            actual = round(parse_trec_eval_output(out), 4)
+            if use_ranx:
+                # Like trec_eval -c, queries missing from the run count as zero. Unlike trec_eval,
+                # ranx does not break score ties by docid, so tied documents can score differently.
+                eval_start = time.time()
+                qrels = load_qrels(qrel)
+                fused_run = Run.from_file(cmd_data.output, kind="trec").make_comparable(qrels)
+                actual = round(float(evaluate(qrels, fused_run, 'ndcg@10')), 4)
+                eval_time = time.time() - eval_start
+            else:
+                ndcg, eval_time = trec_eval_futures[idx].result()
+                actual = round(ndcg, 4)
             expected_r = round(cmd_data.expected, 4)
             delta = abs(actual - expected_r)
             
@@ -253,6 +371,9 @@ def evaluate_results(commands, dry_run):
             if not passed:
                 failures += 1
             
+            if not ranx_check:
+                continue
+
             # Ranx sanity check (non-blocking)
             try:
                 ranx_start = time.time()
@@ -276,6 +397,91 @@ def evaluate_results(commands, dry_run):
     else:
         logger.info(f"\nAll {total} test(s) passed")
 
+def is_native(cmd_data, native):
+    """Whether a fusion command is handled in-process by fusion_numpy rather than by FuseRuns."""
+    return native and cmd_data.method in NATIVE_METHODS
+
+def run_fusion(cmd_data):
+    """Run a single fusion command in a worker, capturing its output so parallel logs don't interleave."""
+    fusion_start = time.time()
+    p = Popen(cmd_data.cmd, stdout=PIPE, stderr=STDOUT, text=True, encoding='utf-8', errors='replace')
+    out, _ = p.communicate()
+    return cmd_data, p.returncode, out, time.time() - fusion_start
+
+def run_fusion_commands(commands, jobs, native=False):
+    """Run fusion commands in parallel; each command writes to its own output file.
+
+    With native, commands fusion_numpy supports are fused in-process first, reading each input run
+    once for all methods of its corpus; only the rest go to FuseRuns.
+    Results are logged in command order. Exits on the first failure.
+    """
+    if any(is_native(cmd_data, native) for cmd_data in commands):
+        import fusion_numpy
+    topic_key = None
+    for cmd_data in commands:
+        if is_native(cmd_data, native):
+            if cmd_data.topic_key != topic_key:
+                # Commands are grouped by corpus, so the previous corpus' runs are no longer needed
+                fusion_numpy.read_run.cache_clear()
+                topic_key = cmd_data.topic_key
+            fusion_start = time.time()
+            try:
+                fusion_numpy.fuse(cmd_data.run_files, cmd_data.output, cmd_data.method, rrf_k=cmd_data.rrf_k,
+                                  k=K, depth=DEPTH, min_max_normalization=cmd_data.has_minmax)
+            except Exception as e:
+                logger.error(f"Fusion failed: native {cmd_data.method} {cmd_data.cond_name} {cmd_data.topic_key}: {e}")
+                sys.exit(1)
+            logger.info(f"Native fusion completed: {cmd_data.cond_name} {cmd_data.topic_key} "
+                        f"in {time.time() - fusion_start:.2f}s")
+    commands = [cmd_data for cmd_data in commands if not is_native(cmd_data, native)]
+    if not commands:
+        return
+
+    total = len(commands)
+    jobs = max(1, min(jobs, total))
+    logger.info(f"Running {total} fusion command(s) with {jobs} job(s)")
+    with Pool(jobs) as p:
+        for idx, (cmd_data, returncode, out, fusion_time) in enumerate(p.imap(run_fusion, commands), 1):
+            if returncode != 0:
+                logger.error(f"[{idx}/{total}] Fusion failed: {' '.join(cmd_data.cmd)}")
+                if out:
+                    logger.error(out)
+                sys.exit(1)
+            logger.info(f"[{idx}/{total}] Fusion completed: {cmd_data.cond_name} {cmd_data.topic_key} in {fusion_time:.2f}s")
+
+def find_missing(paths):
+    """Return the paths that don't exist, in order and without duplicates.
+
+    A directory holding at least SCANDIR_MIN_PATHS of the paths is listed once with os.scandir
+    instead of stat'ing each of its files; the remaining paths are stat'ed, concurrently when
+    there are many of them.
+    """
+    paths = list(dict.fromkeys(paths))
+    by_dir = {}
+    for path in paths:
+        by_dir.setdefault(os.path.dirname(path), []).append(path)
+
+    present = set()
+    to_stat = []
+    for d, dir_paths in by_dir.items():
+        if len(dir_paths) < SCANDIR_MIN_PATHS:
+            to_stat.extend(dir_paths)
+            continue
+        try:
+            with os.scandir(d or '.') as entries:
+                # is_file() follows symlinks, so a dangling link counts as missing
+                names = set(entry.name for entry in entries if entry.is_file())
+        except OSError:
+            names = set()
+        present.update(path for path in dir_paths if os.path.basename(path) in names)
+
+    if len(to_stat) >= SCANDIR_MIN_PATHS:
+        with ThreadPoolExecutor() as executor:
+            present.update(path for path, exists in zip(to_stat, executor.map(os.path.exists, to_stat)) if exists)
+    else:
+        present.update(path for path in to_stat if os.path.exists(path))
+    return [path for path in paths if path not in present]
+
 def prepare_runs(commands, beir_data, dry_run):
     """Prepare required run files: generate missing ones and verify all exist.
     
@@ -290,14 +496,10 @@ def prepare_runs(commands, beir_data, dry_run):
             ensure_runs(beir_data, corpus)
     
     # Verify all required run files exist
-    missing = []
-    for cmd_data in commands:
-        for rf in cmd_data.run_files:
-            if not os.path.exists(rf):
-                missing.append(rf)
+    missing = find_missing(rf for cmd_data in commands for rf in cmd_data.run_files)
     
     if missing:
-        logger.error(f"Missing {len(missing)} run file(s): {', '.join(missing[:3])}{'...' if len(missing) > 3 else ''}")
+        logger.error(f"Missing {len(missing)} run file(s):\n  " + '\n  '.join(missing))
         return False
     
     return True
@@ -306,10 +508,20 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Run fusion regression tests from beir.yaml')
     parser.add_argument('--corpus', help='Corpus name (e.g., nfcorpus). If not specified, runs all.')
     parser.add_argument('--dry-run', action='store_true', help='Show commands without executing')
+    parser.add_argument('--use-ranx', action='store_true',
+                        help='Evaluate in-process with ranx instead of bin/trec_eval. ranx does not break score '
+                             'ties like trec_eval, so scores can differ from the ones in beir.yaml.')
+    parser.add_argument('--ranx-check', action='store_true',
+                        help='Also fuse and score the input runs with ranx, and report how far that is from '
+                             'each fusion score.')
+    parser.add_argument('--native', action='store_true',
+                        help='Fuse in-process with NumPy/pandas (fusion_numpy.py) instead of FuseRuns where supported.')
+    parser.add_argument('--jobs', type=int, default=4,
+                        help='Maximum number of fusion commands (each one starts a JVM) or trec_eval '
+                             'evaluations to run in parallel.')
     args = parser.parse_args()
     
-    with open('src/main/resources/reproduce/beir.yaml') as f:
-        beir_data = yaml.safe_load(f)
+    beir_data = load_yaml(BEIR_YAML)
     
     start = time.time()
     commands = get_fusion_commands(beir_data, args.corpus)
@@ -327,18 +539,13 @@ if __name__ == '__main__':
     # Run fusion
     if args.dry_run:
         for cmd_data in commands:
-            logger.info(' '.join(cmd_data.cmd))
+            if is_native(cmd_data, args.native):
+                logger.info(f"native {cmd_data.method}: {' '.join(cmd_data.run_files)} -> {cmd_data.output}")
+            else:
+                logger.info(' '.join(cmd_data.cmd))
     else:
-        total = len(commands)
-        for idx, cmd_data in enumerate(commands, 1):
-            logger.info(f"[{idx}/{total}] Running fusion: {cmd_data.cond_name} {cmd_data.topic_key}")
-            fusion_start = time.time()
-            if call(' '.join(cmd_data.cmd), shell=True) != 0:
-                logger.error(f"Fusion failed: {' '.join(cmd_data.cmd)}")
-                sys.exit(1)
-            fusion_time = time.time() - fusion_start
-            logger.info(f"  Fusion completed in {fusion_time:.2f}s")
+        run_fusion_commands(commands, args.jobs, args.native)
     
     # Evaluate
-    evaluate_results(commands, args.dry_run)
+    evaluate_results(commands, args.dry_run, args.use_ranx, args.jobs, args.ranx_check)
     logger.info(f"Total time: {time.time() - start:.1f}s")
@@ -0,0 +1,157 @@
+#
+# Anserini: A Lucene toolkit for reproducible information retrieval research
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Tests for fusion_numpy; expected runs are the ones io.anserini.fusion.FusionTest checks for FuseRuns."""
+
+import os
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+sys.path.insert(0, os.path.join(ROOT, 'src', 'main', 'python'))
+
+import fusion_numpy
+
+SAMPLE_RUNS = os.path.join(ROOT, 'src', 'test', 'resources', 'sample_runs')
+RUN1 = os.path.join(SAMPLE_RUNS, 'run1')
+RUN2 = os.path.join(SAMPLE_RUNS, 'run2')
+
+RRF_RUN = [
+    'query1 Q0 doc2 1 0.032522 anserini.fusion',
+    'query1 Q0 doc1 2 0.032522 anserini.fusion',
+    'query1 Q0 doc4 3 0.015873 anserini.fusion',
+    'query1 Q0 doc3 4 0.015873 anserini.fusion',
+    'query2 Q0 doc3 1 0.032266 anserini.fusion',
+    'query2 Q0 doc1 2 0.016393 anserini.fusion',
+    'query2 Q0 doc5 3 0.016129 anserini.fusion',
+    'query2 Q0 doc2 4 0.016129 anserini.fusion',
+    'query2 Q0 doc6 5 0.015873 anserini.fusion',
+]
+
+AVERAGE_RUN = [
+    'query1 Q0 doc2 1 5.500000 anserini.fusion',
+    'query1 Q0 doc1 2 5.500000 anserini.fusion',
+    'query1 Q0 doc3 3 2.500000 anserini.fusion',
+    'query1 Q0 doc4 4 1.500000 anserini.fusion',
+    'query2 Q0 doc3 1 10.500000 anserini.fusion',
+    'query2 Q0 doc1 2 7.000000 anserini.fusion',
+    'query2 Q0 doc2 3 6.500000 anserini.fusion',
+    'query2 Q0 doc5 4 4.000000 anserini.fusion',
+    'query2 Q0 doc6 5 3.500000 anserini.fusion',
+]
+
+AVERAGE_NORM_RUN = [
+    'query1 Q0 doc2 1 0.750000 anserini.fusion',
+    'query1 Q0 doc1 2 0.750000 anserini.fusion',
+    'query1 Q0 doc4 3 0.000000 anserini.fusion',
+    'query1 Q0 doc3 4 0.000000 anserini.fusion',
+    'query2 Q0 doc3 1 0.500000 anserini.fusion',
+    'query2 Q0 doc1 2 0.500000 anserini.fusion',
+    'query2 Q0 doc5 3 0.250000 anserini.fusion',
+    'query2 Q0 doc2 4 0.250000 anserini.fusion',
+    'query2 Q0 doc6 5 0.000000 anserini.fusion',
+]
+
+
+class TestFusionNumpy(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.tmp.name, 'fused_run.test')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def fuse(self, run_files, **kwargs):
+        fusion_numpy.fuse(run_files, self.output, **kwargs)
+        with open(self.output) as f:
+            return f.read().splitlines()
+
+    def test_fuse_rrf(self):
+        self.assertEqual(RRF_RUN, self.fuse([RUN1, RUN2], method='rrf', rrf_k=60))
+
+    def test_fuse_rrf_with_normalization(self):
+        # Normalization is a no-op for RRF, which only uses ranks
+        self.assertEqual(RRF_RUN, self.fuse([RUN1, RUN2], method='rrf', min_max_normalization=True))
+
+    def test_fuse_average(self):
+        self.assertEqual(AVERAGE_RUN, self.fuse([RUN1, RUN2], method='average'))
+
+    def test_fuse_average_with_normalization(self):
+        self.assertEqual(AVERAGE_NORM_RUN, self.fuse([RUN1, RUN2], method='average', min_max_normalization=True))
+
+    def test_fuse_interpolation(self):
+        # Interpolation with alpha=0.5 is the same as averaging two runs
+        self.assertEqual(AVERAGE_RUN, self.fuse([RUN1, RUN2], method='interpolation', alpha=0.5))
+
+    def test_fuse_interpolation_alpha07(self):
+        self.assertEqual([
+            'query1 Q0 doc1 1 6.100000 anserini.fusion',
+            'query1 Q0 doc2 2 5.700000 anserini.fusion',
+            'query1 Q0 doc3 3 3.500000 anserini.fusion',
+            'query1 Q0 doc4 4 0.900000 anserini.fusion',
+            'query2 Q0 doc3 1 11.099999 anserini.fusion',
+            'query2 Q0 doc1 2 9.800000 anserini.fusion',
+            'query2 Q0 doc2 3 9.100000 anserini.fusion',
+            'query2 Q0 doc5 4 2.400000 anserini.fusion',
+            'query2 Q0 doc6 5 2.100000 anserini.fusion',
+        ], self.fuse([RUN1, RUN2], method='interpolation', alpha=0.7))
+
+    def test_fuse_k(self):
+        self.assertEqual([line for line in RRF_RUN if int(line.split()[3]) <= 2],
+                         self.fuse([RUN1, RUN2], method='rrf', k=2))
+
+    def test_fuse_depth(self):
+        # As in ScoredDocsFuser.merge, depth caps how many runs are summed for each (qid, docid), in run
+        # order; documents below rank depth are still fused
+        self.assertEqual([
+            'query1 Q0 doc1 1 0.016393 anserini.fusion',
+            'query1 Q0 doc2 2 0.016129 anserini.fusion',
+            'query1 Q0 doc4 3 0.015873 anserini.fusion',
+            'query1 Q0 doc3 4 0.015873 anserini.fusion',
+            'query2 Q0 doc1 1 0.016393 anserini.fusion',
+            'query2 Q0 doc5 2 0.016129 anserini.fusion',
+            'query2 Q0 doc2 3 0.016129 anserini.fusion',
+            'query2 Q0 doc6 4 0.015873 anserini.fusion',
+            'query2 Q0 doc3 5 0.015873 anserini.fusion',
+        ], self.fuse([RUN1, RUN2], method='rrf', depth=1))
+
+    def test_invalid_depth(self):
+        with self.assertRaisesRegex(ValueError, 'Option depth must be greater than 0'):
+            fusion_numpy.fuse([RUN1, RUN2], self.output, depth=0)
+
+    def test_invalid_k(self):
+        with self.assertRaisesRegex(ValueError, 'Option k must be greater than 0'):
+            fusion_numpy.fuse([RUN1, RUN2], self.output, k=0)
+
+    def test_invalid_method(self):
+        with self.assertRaisesRegex(ValueError, 'Unknown fusion method: add'):
+            fusion_numpy.fuse([RUN1, RUN2], self.output, method='add')
+
+    def test_interpolation_invalid_run_count(self):
+        with self.assertRaisesRegex(ValueError, 'Interpolation requires exactly 2 runs'):
+            fusion_numpy.fuse([RUN1, RUN2, os.path.join(SAMPLE_RUNS, 'run3')], self.output, method='interpolation')
+
+    def test_empty_runs(self):
+        empty = os.path.join(self.tmp.name, 'empty')
+        open(empty, 'w').close()
+        with self.assertRaisesRegex(ValueError, 'Nothing to save'):
+            fusion_numpy.fuse([empty, empty], self.output)
+        self.assertFalse(os.path.exists(self.output))
+
+
+if __name__ == '__main__':
+    unittest.main()